@@ -1,11 +1,18 @@
 import streamlit as st
 import fitz  # PyMuPDF
 import spacy
+from spacy.attrs import LEMMA, IS_ALPHA
 import re
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from collections import Counter
+import numpy as np
 import pandas as pd
 from spellchecker import SpellChecker
 import io
+import hashlib
+import xlsxwriter
 
 st.set_page_config(page_title="Vocabulator", layout="wide")
 
@@ -41,11 +48,39 @@ SUPPORTED_LANGUAGES = {
     "Ukrainian (Українська)": {"spacy": "uk_core_news_sm", "spellchecker": None}
 }
 
+# PDFs with fewer pages than this are read serially; the process pool isn't worth it for them.
+PARALLEL_PAGES_THRESHOLD = 8
+MAX_PDF_WORKERS = 4
+
+# Only lemmas are read from the spaCy docs, so these components are never loaded.
+UNUSED_SPACY_PIPES = ["parser", "ner", "senter"]
+
+# PyMuPDF's default text flags, minus ligature and whitespace preservation (the cleaner and
+# tokenizer don't need either), plus joining words hyphenated across line breaks.
+PDF_TEXT_FLAGS = (
+    fitz.TEXTFLAGS_TEXT & ~(fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE)
+) | fitz.TEXT_DEHYPHENATE
+
+# Anything except word characters (letters, numbers, underscore), whitespace, and hyphens.
+# Most language characters should be covered by \w in Python 3's re with Unicode.
+NON_WORD_PATTERN = re.compile(r"[^\w\s-]")
+
+# The same characters within ASCII, for str.translate. On pure-ASCII text this is many times
+# faster than the regex; on any other text it is slower, so it is only used for ASCII pages.
+ASCII_NON_WORD_TABLE = str.maketrans("", "", "".join(
+    char for char in map(chr, range(128))
+    if not (char.isalnum() or char.isspace() or char in "_-")
+))
+
 
 @st.cache_resource
 def load_spacy_model(model_name):
     try:
-        return spacy.load(model_name)
+        try:
+            return spacy.load(model_name, exclude=UNUSED_SPACY_PIPES)
+        except ValueError:
+            # Some pipelines can't be built without these components; load them in full.
+            return spacy.load(model_name)
     except OSError:
         st.error(
             f"SpaCy model '{model_name}' not found. "
@@ -53,6 +88,87 @@ def load_spacy_model(model_name):
         )
         st.stop()
 
+@st.cache_resource
+def load_spellchecker(language_code):
+    return SpellChecker(language=language_code)
+
+def _extract_pages(shm_name, pdf_size, start, end):
+    """
+    Opens the PDF from shared memory and returns the texts of pages [start, end). Runs in a worker process.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    pdf_buffer = shm.buf[:pdf_size]
+    try:
+        doc = fitz.open(stream=pdf_buffer, filetype="pdf")
+        try:
+            return [doc[i].get_text("text", flags=PDF_TEXT_FLAGS) for i in range(start, end)]
+        finally:
+            doc.close()
+    finally:
+        # The view must be released before the shared memory can be closed.
+        pdf_buffer.release()
+        shm.close()
+
+def extract_pdf_text(pdf_bytes, page_count):
+    """
+    Yields the text of each page, splitting the pages into blocks that are read in parallel.
+    """
+    workers = min(os.cpu_count() or 1, MAX_PDF_WORKERS)
+    block_size = max(1, page_count // workers)
+    # The PDF is placed in shared memory once, instead of being pickled to every worker.
+    shm = shared_memory.SharedMemory(create=True, size=len(pdf_bytes))
+    try:
+        shm.buf[:len(pdf_bytes)] = pdf_bytes
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_extract_pages, shm.name, len(pdf_bytes), start, min(start + block_size, page_count))
+                for start in range(0, page_count, block_size)
+            ]
+            # Yielded in submission order so the texts keep the page order.
+            for f in futures:
+                yield from f.result()
+    finally:
+        shm.close()
+        shm.unlink()
+
+def iter_cleaned_pages(doc, pdf_bytes):
+    """
+    Yields the cleaned text of each page as it is extracted, without joining the pages.
+    """
+    if doc.page_count < PARALLEL_PAGES_THRESHOLD:
+        page_texts = (page.get_text("text", flags=PDF_TEXT_FLAGS) for page in doc)
+    else:
+        page_texts = extract_pdf_text(pdf_bytes, doc.page_count)
+    # Runs of whitespace are left alone; spaCy's tokenizer doesn't need them collapsed.
+    for text in page_texts:
+        if text.isascii():
+            yield text.translate(ASCII_NON_WORD_TABLE)
+        else:
+            yield NON_WORD_PATTERN.sub("", text)
+
+def alpha_lemma_hashes(spacy_doc):
+    """
+    Returns the lemma hashes of the alphabetic tokens of a Doc, without creating a Python object per token.
+    """
+    token_attrs = spacy_doc.to_array([LEMMA, IS_ALPHA])
+    return token_attrs[token_attrs[:, 1] == 1, 0]
+
+def meaningful_lemma_counts(lemma_hash_arrays, strings):
+    """
+    Counts the lemma hashes in NumPy and resolves them to lowercase lemmas, keeping those
+    longer than one character. Each distinct lemma is looked up once.
+    """
+    lemma_hashes, hash_counts = np.unique(np.concatenate(lemma_hash_arrays), return_counts=True)
+    counter = Counter()
+    for lemma_hash, count in zip(lemma_hashes.tolist(), hash_counts.tolist()):
+        lemma = strings[lemma_hash]
+        if len(lemma) > 1:
+            # Most lemmatizers already produce lowercase lemmas; only copy the ones that aren't.
+            if not lemma.islower():
+                lemma = lemma.lower()
+            counter[lemma] += count
+    return counter
+
 def extract_book_words(pdf_bytes, language_details, remove_stopwords: bool, enable_spellcheck: bool):
     """
     Reads a PDF, cleans text, extracts words, and returns a DataFrame of word frequencies.
@@ -64,70 +180,68 @@ def extract_book_words(pdf_bytes, language_details, remove_stopwords: bool, enab
         st.error(f"Error reading PDF file: {e}")
         return None
 
-    raw_text = "".join(page.get_text("text") for page in doc)
-    doc.close()
-
-    if not raw_text.strip():
+    try:
+        st.info("Cleaning and processing text...")
+
+        spacy_model_name = language_details["spacy"]
+        nlp = load_spacy_model(spacy_model_name)
+
+        # Pages are streamed from the PDF into spaCy, which tokenizes and lemmatizes them
+        # in batches. Only the lemma hashes of each page are kept for counting.
+        text_found = False
+        lemma_hash_arrays = []
+        for spacy_doc in nlp.pipe(iter_cleaned_pages(doc, pdf_bytes), batch_size=32):
+            if not text_found:
+                text_found = bool(spacy_doc.text.strip())
+            lemma_hash_arrays.append(alpha_lemma_hashes(spacy_doc))
+    finally:
+        doc.close()
+
+    if not text_found:
         st.warning("No text could be extracted from the PDF, or the file is empty.")
         return None
 
-    st.info("Cleaning and processing text...")
-
-    # Keep word characters (letters, numbers, underscore), whitespace, and hyphens.
-    # Most language characters should be covered by \w in Python 3's re with Unicode.
-    cleaned_text = re.sub(r"[^\w\s-]", "", raw_text)
-    cleaned_text = re.sub(r"\s+", " ", cleaned_text).strip()
-
-    spacy_model_name = language_details["spacy"]
-    nlp = load_spacy_model(spacy_model_name)
-
-    spacy_doc = nlp(cleaned_text)
-
-    # Tokenize, lemmatize, and ensure lemmas are alphabetic and longer than one character.
-    lemmas = [
-        word.lemma_.lower()
-        for word in spacy_doc
-        if word.is_alpha and len(word.lemma_) > 1
-    ]
+    counter = meaningful_lemma_counts(lemma_hash_arrays, nlp.vocab.strings)
 
     # Optional
-    if remove_stopwords: 
+    if remove_stopwords:
         st.info("Removing stopwords...")
-        stop_words = nlp.Defaults.stop_words
-        lemmas = [lemma for lemma in lemmas if lemma not in stop_words]
+        # Stopwords are matched against the distinct lemmas in one C-level set intersection.
+        for stop_word in nlp.Defaults.stop_words.intersection(counter):
+            del counter[stop_word]
 
-    if not lemmas:
+    if not counter:
         st.warning("No processable words found after initial filtering (and optional stopword removal).")
         return None
 
-    meaningful_lemmas = list(lemmas) # Start with current lemmas
-
     # Optional
     if enable_spellcheck:
         spellchecker_code = language_details.get("spellchecker")
         if spellchecker_code: # Check if a spellchecker code is defined for the language
             st.info(f"Attempting spell checking for language code: '{spellchecker_code}'...")
             try:
-                spell = SpellChecker(language=spellchecker_code)
-                dictionary_words = spell.known(meaningful_lemmas)
-                
-                # Filter out unknown words
-                current_lemmas_after_spellcheck = [lemma for lemma in meaningful_lemmas if lemma in dictionary_words]
+                spell = load_spellchecker(spellchecker_code)
+                # Look up each distinct lemma once rather than every occurrence.
+                # Lemmas are already lowercase, so the known words are a subset of the counter's keys.
+                dictionary_words = spell.known(counter)
 
-                if meaningful_lemmas and not current_lemmas_after_spellcheck:
+                # Keep only known words
+                counter_after_spellcheck = Counter({lemma: counter[lemma] for lemma in dictionary_words})
+
+                if counter and not counter_after_spellcheck:
                     st.warning(
                         f"Spell checking for '{spellchecker_code}' filtered out all words. "
                         "This might be due to limited dictionary coverage for this text. "
                         "Proceeding with words before spell check."
                     )
-                    # meaningful_lemmas remains as it was before this spell check attempt
-                elif not dictionary_words and meaningful_lemmas:
+                    # counter remains as it was before this spell check attempt
+                elif not dictionary_words and counter:
                      st.warning(
                         f"No words from the text were found in the '{spellchecker_code}' dictionary. "
                         "Spell checking may not be effective. Proceeding with words before spell check."
                     )
                 else:
-                    meaningful_lemmas = current_lemmas_after_spellcheck
+                    counter = counter_after_spellcheck
 
             except Exception as e: # Catches errors from SpellChecker
                 st.warning(
@@ -139,17 +253,49 @@ def extract_book_words(pdf_bytes, language_details, remove_stopwords: bool, enab
             st.info("Spell checking is enabled, but the selected language does not have a configured or supported spellchecker. Skipping.")
 
 
-    if not meaningful_lemmas:
+    if not counter:
         st.warning("No words remained after all processing steps.")
         return None
 
-    df = pd.DataFrame(
-        Counter(meaningful_lemmas).items(),
-        columns=['Word', 'Count']
-    ).sort_values(by="Count", ascending=False)
+    # Words are stored as Arrow strings rather than Python objects; Streamlit sends the
+    # table to the browser as Arrow too, so it is displayed without another conversion.
+    words, counts = zip(*counter.most_common())
+    df = pd.DataFrame({
+        'Word': pd.array(words, dtype="string[pyarrow]"),
+        'Count': counts
+    })
 
     return df
 
+@st.cache_data(max_entries=4, show_spinner=False)
+def cached_extract_book_words(pdf_hash, _pdf_bytes, language_details, remove_stopwords: bool, enable_spellcheck: bool):
+    """
+    Memoizes extract_book_words. The PDF is keyed by its hash; the leading underscore
+    keeps Streamlit from hashing the raw bytes on every call.
+    """
+    return extract_book_words(
+        _pdf_bytes,
+        language_details,
+        remove_stopwords,
+        enable_spellcheck
+    )
+
+@st.cache_data
+def make_excel(df):
+    """
+    Serializes the results to an Excel workbook, row by row.
+    """
+    output_excel = io.BytesIO()
+    # constant_memory flushes each row as soon as the next one starts. pandas' to_excel
+    # writes column by column, which that mode doesn't support, so rows are written here.
+    workbook = xlsxwriter.Workbook(output_excel, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('WordAnalysis')
+    worksheet.write_row(0, 0, df.columns.tolist(), workbook.add_format({'bold': True}))
+    for row, values in enumerate(df.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row, 0, values)
+    workbook.close()
+    return output_excel.getvalue()
+
 # --- Streamlit UI ---
 st.title(" Vocabulator: Word Extractor")
 st.markdown("Extract word frequencies from your PDF documents.")
@@ -217,8 +363,10 @@ if st.session_state['show_spellcheck_info']:
 if st.button("Analyze PDF", type="primary"):
     if uploaded_file is not None:
         pdf_bytes = uploaded_file.getvalue()
+        pdf_hash = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
         with st.spinner("Analyzing words... This may take a moment depending on file size and language."):
-            df_results = extract_book_words(
+            df_results = cached_extract_book_words(
+                pdf_hash,
                 pdf_bytes,
                 language_details,
                 remove_stopwords_option,
@@ -229,26 +377,17 @@ if st.button("Analyze PDF", type="primary"):
             st.success("Word analysis complete!")
             st.dataframe(df_results.head(200), height=500, use_container_width=True)
 
-            output_excel = io.BytesIO()
-            with pd.ExcelWriter(output_excel, engine='xlsxwriter') as writer:
-                df_results.to_excel(writer, index=False, sheet_name='WordAnalysis')
-            excel_data = output_excel.getvalue()
-
-            output_csv = io.StringIO()
-            df_results.to_csv(output_csv, index=False)
-            csv_data = output_csv.getvalue()
-
-            # Excel and CSV buttons
+            # Excel and CSV buttons. The files are only generated when their button is clicked.
             st.download_button(
                 label="Download Results as Excel",
-                data=excel_data,
+                data=lambda: make_excel(df_results),
                 file_name=f"{uploaded_file.name.rsplit('.', 1)[0]}_words.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
             
             st.download_button(
                 label="Download Results as CSV",
-                data=csv_data,
+                data=lambda: df_results.to_csv(index=False).encode("utf-8"),
                 file_name=f"{uploaded_file.name.rsplit('.', 1)[0]}_words.csv",
                 mime="text/csv"
                 )